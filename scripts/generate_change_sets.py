@@ -0,0 +1,315 @@
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Iterable
+import yaml
+
+from .process_path_filter import load_filter_file, load_git_changes, run_git
+
+#
+# Generate synthetic PR branches offline for load-testing the filter pipeline.
+#
+# Change-set shapes are read from the YAML file specified in SHAPES_FILE:
+#
+# - name: <shape name, used in the branch names>
+#   branches: <number of branches to generate>
+#   files: <number of changed files per branch>
+#   directories: <number of directories the changes are spread across>
+#   path-prefix: <only change files under this prefix>           (optional)
+#   skip-fraction: <share of files added with a skip-if suffix>  (optional)
+#   skip-suffixes: [<suffix>, ...]                               (optional)
+#   rename-fraction: <share of files renamed>                    (optional)
+#   delete-fraction: <share of files deleted>                    (optional)
+#
+# The remaining files are modifications of existing files. All branches are
+# written with a single `git fast-import` process rather than a git add/commit
+# per change, so thousands of branches can be generated in seconds.
+#
+# Run from the repo root with `python -m scripts.generate_change_sets`.
+# Set BENCHMARK_FILTER_FILE to time load_git_changes and the filter engine
+# against every generated branch.
+#
+
+DEFAULT_SKIP_SUFFIXES = [".md"]
+
+
+class ChangeSetShape:
+    def __init__(
+        self,
+        name: str,
+        branches: int,
+        files: int,
+        directories: int,
+        path_prefix: str = "",
+        skip_fraction: float = 0.0,
+        skip_suffixes: list[str] | None = None,
+        rename_fraction: float = 0.0,
+        delete_fraction: float = 0.0,
+    ):
+        self.name = name
+        self.branches = branches
+        self.files = files
+        self.directories = directories
+        self.path_prefix = path_prefix
+        self.skip_fraction = skip_fraction
+        self.skip_suffixes = skip_suffixes or DEFAULT_SKIP_SUFFIXES
+        self.rename_fraction = rename_fraction
+        self.delete_fraction = delete_fraction
+
+        for key, value in [("branches", branches), ("files", files), ("directories", directories)]:
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError(f"Shape {name}: {key} must be a positive integer, got {value!r}")
+        for key, value in [("skip", skip_fraction), ("rename", rename_fraction), ("delete", delete_fraction)]:
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 <= value <= 1:
+                raise ValueError(f"Shape {name}: {key} fraction must be between 0 and 1, got {value!r}")
+        if skip_fraction + rename_fraction + delete_fraction > 1:
+            raise ValueError(f"Shape {name}: skip, rename and delete fractions add up to more than 1")
+
+
+class ChangeSet:
+    def __init__(self, branch: str):
+        self.branch = branch
+        self.modified: dict[str, bytes] = {}  # path -> new content
+        self.renamed: dict[str, str] = {}  # old path -> new path
+        self.deleted: list[str] = []
+        self.substituted = 0  # deletes, renames and modifications added as new files instead
+
+    @property
+    def changed_files(self) -> list[str]:
+        """
+        The file names git reports for the change set (renames are reported by their new name)
+        """
+        return sorted([*self.modified.keys(), *self.renamed.values(), *self.deleted])
+
+
+def load_shapes_file(shapes_file: str) -> list[ChangeSetShape]:
+    with open(shapes_file, "r") as f:
+        shape_data = yaml.safe_load(f)
+    if shape_data is None:
+        print(f"Shapes file {shapes_file} is empty.", flush=True)
+        sys.exit(1)
+    if not isinstance(shape_data, list):
+        print(f"Shapes file {shapes_file} is not a list.", flush=True)
+        sys.exit(1)
+
+    shapes = []
+    for shape_item in shape_data:
+        for key in ["name", "branches", "files", "directories"]:
+            if key not in shape_item:
+                print(f"Shapes file {shapes_file} has a shape without {key}.", flush=True)
+                sys.exit(1)
+        shapes.append(
+            ChangeSetShape(
+                name=shape_item["name"],
+                branches=shape_item["branches"],
+                files=shape_item["files"],
+                directories=shape_item["directories"],
+                path_prefix=shape_item.get("path-prefix", ""),
+                skip_fraction=shape_item.get("skip-fraction", 0.0),
+                skip_suffixes=shape_item.get("skip-suffixes"),
+                rename_fraction=shape_item.get("rename-fraction", 0.0),
+                delete_fraction=shape_item.get("delete-fraction", 0.0),
+            )
+        )
+    return shapes
+
+
+def load_tree_directories(base_ref: str, repo_path: str = ".") -> dict[str, list[str]]:
+    """
+    Map each directory in base_ref to the files directly inside it
+    """
+    directories: dict[str, list[str]] = {}
+    for path in run_git(["ls-tree", "-r", "--name-only", base_ref], repo_path).splitlines():
+        directories.setdefault(os.path.dirname(path), []).append(path)
+    return directories
+
+
+NAME_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def random_name(rng: random.Random, size: int = 8) -> str:
+    return "".join(rng.choices(NAME_ALPHABET, k=size))
+
+
+def random_content(rng: random.Random, lines: int = 20) -> bytes:
+    data = rng.randbytes(8 * lines).hex().encode("ascii")
+    return b"".join(data[i:i + 16] + b"\n" for i in range(0, len(data), 16))
+
+
+def build_change_set(
+    shape: ChangeSetShape, branch: str, directories: dict[str, list[str]], rng: random.Random
+) -> ChangeSet:
+    candidates = sorted(d for d in directories if d.startswith(shape.path_prefix))
+    if len(candidates) == 0:
+        raise ValueError(f"Shape {shape.name}: no directories under '{shape.path_prefix}'")
+    chosen = rng.sample(candidates, min(shape.directories, len(candidates)))
+
+    # counts are rounded independently, so clamp each to what is left to keep the total at shape.files
+    delete_count = min(round(shape.files * shape.delete_fraction), shape.files)
+    rename_count = min(round(shape.files * shape.rename_fraction), shape.files - delete_count)
+    skip_count = min(round(shape.files * shape.skip_fraction), shape.files - delete_count - rename_count)
+    kinds = (
+        ["delete"] * delete_count
+        + ["rename"] * rename_count
+        + ["skip"] * skip_count
+        + ["modify"] * (shape.files - delete_count - rename_count - skip_count)
+    )
+    rng.shuffle(kinds)
+
+    # spread the changes round-robin over the chosen directories, each existing file is used at most once
+    per_directory = -(-len(kinds) // len(chosen))
+    available = {d: rng.sample(directories[d], min(per_directory, len(directories[d]))) for d in chosen}
+    change_set = ChangeSet(branch)
+    for i, kind in enumerate(kinds):
+        directory = chosen[i % len(chosen)]
+        if kind == "skip":
+            suffix = rng.choice(shape.skip_suffixes)
+            change_set.modified[os.path.join(directory, f"{random_name(rng)}{suffix}")] = random_content(rng)
+            continue
+        if len(available[directory]) == 0:
+            # directory exhausted, use another chosen directory with files left or add a new file instead
+            remaining = [d for d in chosen if len(available[d]) > 0]
+            if len(remaining) == 0:
+                change_set.modified[os.path.join(directory, f"{random_name(rng)}.txt")] = random_content(rng)
+                change_set.substituted += 1
+                continue
+            directory = rng.choice(remaining)
+        path = available[directory].pop()
+        if kind == "delete":
+            change_set.deleted.append(path)
+        elif kind == "rename":
+            _, ext = os.path.splitext(path)
+            change_set.renamed[path] = os.path.join(directory, f"{random_name(rng)}{ext}")
+        else:
+            change_set.modified[path] = random_content(rng)
+    return change_set
+
+
+def quote_path(path: str) -> str:
+    # fast-import needs C-style quoting for paths with spaces (in R commands) or special characters
+    if any(c in path for c in ' "\\\n') or path.startswith('"'):
+        return '"' + path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return path
+
+
+def fast_import_commands(change_set: ChangeSet, base_commit: str, timestamp: int) -> Iterable[bytes]:
+    message = f"Synthetic change set {change_set.branch}\n".encode("utf-8")
+    yield f"commit refs/heads/{change_set.branch}\n".encode("utf-8")
+    yield f"committer Change Set Generator <generator@example.com> {timestamp} +0000\n".encode("utf-8")
+    yield f"data {len(message)}\n".encode("utf-8") + message
+    yield f"from {base_commit}\n".encode("utf-8")
+    for path in change_set.deleted:
+        yield f"D {quote_path(path)}\n".encode("utf-8")
+    for old_path, new_path in change_set.renamed.items():
+        yield f"R {quote_path(old_path)} {quote_path(new_path)}\n".encode("utf-8")
+    for path, content in change_set.modified.items():
+        yield f"M 100644 inline {quote_path(path)}\ndata {len(content)}\n".encode("utf-8") + content
+    yield b"\n"
+
+
+def write_change_sets(change_sets: Iterable[ChangeSet], base_commit: str, repo_path: str = ".") -> int:
+    """
+    Write all change sets as branches off base_commit with a single git fast-import process
+
+    Existing branches with the same names are overwritten. Returns the number of branches written
+    """
+    timestamp = int(time.time())
+    process = subprocess.Popen(
+        ["git", "fast-import", "--quiet", "--force"],
+        cwd=repo_path,
+        stdin=subprocess.PIPE,
+    )
+    count = 0
+    try:
+        for change_set in change_sets:
+            for command in fast_import_commands(change_set, base_commit, timestamp):
+                process.stdin.write(command)
+            count += 1
+        process.stdin.write(b"done\n")
+    finally:
+        process.stdin.close()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return count
+
+
+def generate_change_sets(
+    shapes: list[ChangeSetShape],
+    base_ref: str,
+    branch_prefix: str = "synthetic",
+    seed: int = 0,
+    repo_path: str = ".",
+) -> list[ChangeSet]:
+    rng = random.Random(seed)
+    base_commit = run_git(["rev-parse", "--verify", f"{base_ref}^{{commit}}"], repo_path).strip()
+    directories = load_tree_directories(base_commit, repo_path)
+
+    change_sets = []
+    for shape in shapes:
+        shape_change_sets = [
+            build_change_set(shape, f"{branch_prefix}/{shape.name}-{i:05d}", directories, rng)
+            for i in range(shape.branches)
+        ]
+        substituted = sum(change_set.substituted for change_set in shape_change_sets)
+        if substituted > 0:
+            print(
+                f"WARNING: Shape {shape.name} - the chosen directories ran out of existing files, "
+                f"{substituted} of {shape.files * shape.branches} changes were added as new files instead "
+                "of the requested delete/rename/modify",
+                flush=True,
+            )
+        change_sets.extend(shape_change_sets)
+    write_change_sets(change_sets, base_commit, repo_path)
+    return change_sets
+
+
+def benchmark_filters(change_sets: list[ChangeSet], base_ref: str, filter_file: str, repo_path: str = "."):
+    filters = load_filter_file(filter_file)
+    git_time = 0.0
+    filter_time = 0.0
+    file_count = 0
+    for change_set in change_sets:
+        # load_git_changes and is_match log every file, keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            files = load_git_changes(compare_to=base_ref, repo_path=repo_path, head=change_set.branch)
+            git_time += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for filter in filters:
+                filter.is_match(files)
+            filter_time += time.perf_counter() - start_time
+        file_count += len(files)
+
+    count = len(change_sets)
+    print(f"Benchmarked {count} branches ({file_count} changed files) against {len(filters)} filters", flush=True)
+    print(f"load_git_changes: {git_time:.3f}s total, {git_time / count * 1000:.2f}ms per branch", flush=True)
+    print(f"filter matching:  {filter_time:.3f}s total, {filter_time / count * 1000:.2f}ms per branch", flush=True)
+
+
+if __name__ == "__main__":
+    base_ref = os.getenv("BASE_REF", "HEAD")
+    branch_prefix = os.getenv("BRANCH_PREFIX", "synthetic")
+    seed = int(os.getenv("SEED", "0"))
+
+    shapes_file = os.getenv("SHAPES_FILE")
+    if shapes_file is None:
+        print("SHAPES_FILE environment variable is not set.", flush=True)
+        sys.exit(1)
+    if not os.path.exists(shapes_file):
+        print(f"Shapes file {shapes_file} does not exist.", flush=True)
+        sys.exit(1)
+
+    shapes = load_shapes_file(shapes_file)
+    start_time = time.time()
+    change_sets = generate_change_sets(shapes, base_ref, branch_prefix=branch_prefix, seed=seed)
+    duration = time.time() - start_time
+    print(f"Generated {len(change_sets)} branches under {branch_prefix}/ in {duration:.3f} seconds", flush=True)
+
+    benchmark_filter_file = os.getenv("BENCHMARK_FILTER_FILE")
+    if benchmark_filter_file is not None:
+        benchmark_filters(change_sets, base_ref, benchmark_filter_file)
@@ -4,7 +4,7 @@ import json
 import os
 import re
 import time
-from typing import Iterable
+from typing import Callable, Iterable
 import requests
 import subprocess
 import sys
@@ -28,16 +28,426 @@ import yaml
 #
 
 
+#
+# Path expressions are analysed when they are loaded so that a single expensive
+# pattern in a shared filter file can't stall every pipeline:
+#
+# - literal:     the expression is rewritten to plain string checks (prefix, exact,
+#                prefix + suffix, prefix + contains) that give the same result as re.match
+# - linear:      evaluated with the regex, at most one unbounded repeat per sequence
+# - polynomial:  several unbounded repeats in sequence (e.g. `a.*b.*c`, `(.*a){3}`), nested
+#                repeats that can't overlap (e.g. `([^/]+/)*`) or an alternation under an
+#                unbounded repeat (e.g. `(ab|cd)+`) - reported as a warning
+# - exponential: a repeated sub-expression that can match the same text in more than one
+#                way, e.g. an inner repeat that can also match what follows it (`(a+)+`,
+#                `(.*a){12}`), alternatives that overlap (`(a|aa)+`) or a bounded repeat of
+#                an optional body (`(a?){24}`) - can backtrack catastrophically and is
+#                rejected by load_filter_file
+#
+
+PATTERN_COST_LITERAL = "literal"
+PATTERN_COST_LINEAR = "linear"
+PATTERN_COST_POLYNOMIAL = "polynomial"
+PATTERN_COST_EXPONENTIAL = "exponential"
+
+# bounded repeats with a larger maximum backtrack like unbounded ones
+LARGE_BOUNDED_REPEAT = 10
+
+# the regex parser is a CPython internal, analysis is skipped (and every pattern is
+# treated as linear) if it isn't available or has changed shape
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+
+    _REPEAT_OPS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+    _BEGIN_ANCHORS = (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING)
+    _END_ANCHORS = (sre_constants.AT_END, sre_constants.AT_END_STRING)
+    _CHAR_OPS = (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN)
+    _ANY_CHAR = (sre_constants.ANY, None)
+    _CATEGORY_REGEXES = {
+        sre_constants.CATEGORY_DIGIT: re.compile(r"\d"),
+        sre_constants.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+        sre_constants.CATEGORY_SPACE: re.compile(r"\s"),
+        sre_constants.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+        sre_constants.CATEGORY_WORD: re.compile(r"\w"),
+        sre_constants.CATEGORY_NOT_WORD: re.compile(r"\W"),
+    }
+except (ImportError, AttributeError):
+    sre_constants = sre_parse = None
+
+
+class PatternAnalysis:
+    cost: str
+    kind: str  # "prefix", "exact", "prefix-suffix", "prefix-contains" or "regex"
+    matcher: Callable[[str], bool] | None  # string-based equivalent of re.match, if one exists
+
+    def __init__(self, cost: str, kind: str, matcher: Callable[[str], bool] | None = None):
+        self.cost = cost
+        self.kind = kind
+        self.matcher = matcher
+
+
+def _sub_patterns(op, av) -> list:
+    if op in _REPEAT_OPS or op == sre_constants.POSSESSIVE_REPEAT:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[3]]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [sub for sub in av[1:] if sub is not None]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_constants.ATOMIC_GROUP:
+        return [av]
+    return []
+
+
+def _is_unbounded_repeat(op, av) -> bool:
+    # possessive repeats don't backtrack so are excluded
+    return op in _REPEAT_OPS and av[1] == sre_constants.MAXREPEAT
+
+
+def _first_atoms(items) -> tuple[list, bool]:
+    """
+    Return the single-character atoms a sequence can start with and whether it can match empty
+    """
+    atoms = []
+    for op, av in items:
+        if op in _CHAR_OPS:
+            return [*atoms, (op, av)], False
+        if op in _REPEAT_OPS or op == sre_constants.POSSESSIVE_REPEAT:
+            sub_atoms, nullable = _first_atoms(av[2])
+            atoms += sub_atoms
+            if av[0] > 0 and not nullable:
+                return atoms, False
+        elif op in (sre_constants.SUBPATTERN, sre_constants.BRANCH, sre_constants.GROUPREF_EXISTS, sre_constants.ATOMIC_GROUP):
+            subs = _sub_patterns(op, av)
+            nullable = op == sre_constants.GROUPREF_EXISTS and av[2] is None
+            for sub in subs:
+                sub_atoms, sub_nullable = _first_atoms(sub)
+                atoms += sub_atoms
+                nullable = nullable or sub_nullable
+            if not nullable:
+                return atoms, False
+        elif op not in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            # e.g. back references - could be anything
+            return [*atoms, _ANY_CHAR], False
+    return atoms, True
+
+
+def _all_atoms(items) -> list:
+    atoms = []
+    for op, av in items:
+        if op in _CHAR_OPS:
+            atoms.append((op, av))
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue
+        elif op == sre_constants.GROUPREF:
+            atoms.append(_ANY_CHAR)
+        else:
+            for sub in _sub_patterns(op, av):
+                atoms += _all_atoms(sub)
+    return atoms
+
+
+def _atom_chars(atom) -> set[int] | None:
+    """
+    Return the characters matched by an atom, or None if there are too many to list
+    """
+    op, av = atom
+    if op == sre_constants.LITERAL:
+        return {av}
+    if op != sre_constants.IN:
+        return None
+    chars = set()
+    for item_op, item_av in av:
+        if item_op == sre_constants.LITERAL:
+            chars.add(item_av)
+        elif item_op == sre_constants.RANGE and item_av[1] - item_av[0] < 256:
+            chars.update(range(item_av[0], item_av[1] + 1))
+        else:
+            return None
+    return chars
+
+
+def _atom_matches(atom, char: int) -> bool:
+    op, av = atom
+    if op == sre_constants.LITERAL:
+        return char == av
+    if op == sre_constants.NOT_LITERAL:
+        return char != av
+    if op == sre_constants.ANY:
+        return av is None or char != ord("\n")
+    negate = False
+    matched = False
+    for item_op, item_av in av:
+        if item_op == sre_constants.NEGATE:
+            negate = True
+        elif item_op == sre_constants.LITERAL:
+            matched = matched or char == item_av
+        elif item_op == sre_constants.RANGE:
+            matched = matched or item_av[0] <= char <= item_av[1]
+        elif item_op == sre_constants.CATEGORY and item_av in _CATEGORY_REGEXES:
+            matched = matched or _CATEGORY_REGEXES[item_av].match(chr(char)) is not None
+        else:
+            # unknown set item, assume it matches so overlaps are over- rather than under-reported
+            matched = True
+    return matched != negate
+
+
+def _overlaps(atoms: list, other_atoms: list) -> bool:
+    """
+    Check if any character can be matched by both an atom in atoms and one in other_atoms
+    """
+    for atom in atoms:
+        for other in other_atoms:
+            chars = _atom_chars(atom)
+            if chars is not None:
+                if any(_atom_matches(other, char) for char in chars):
+                    return True
+                continue
+            other_chars = _atom_chars(other)
+            if other_chars is None or any(_atom_matches(atom, char) for char in other_chars):
+                return True
+    return False
+
+
+def _is_backtracking_repeat(op, av) -> bool:
+    """
+    Check if a repeat can try many different iteration counts (unbounded, large or with an optional body)
+    """
+    if op not in _REPEAT_OPS or av[1] <= 1:
+        return False
+    return av[1] == sre_constants.MAXREPEAT or av[1] >= LARGE_BOUNDED_REPEAT or _first_atoms(av[2])[1]
+
+
+def _is_ambiguous_sequence(items, follow: list) -> bool:
+    """
+    Check if part of a repeated sequence can match the same text in more than one way
+
+    follow holds the atoms that can come after the sequence (including the start of the next iteration)
+    """
+    items = list(items)
+    for index, (op, av) in enumerate(items):
+        item_follow, nullable = _first_atoms(items[index + 1:])
+        if nullable:
+            item_follow = item_follow + follow
+        if op in _REPEAT_OPS and av[1] > 1:
+            # an inner repeat that can also match what follows it can split the text in many ways
+            if _overlaps(_all_atoms(av[2]), item_follow):
+                return True
+            if _is_ambiguous_sequence(av[2], _first_atoms(av[2])[0] + item_follow):
+                return True
+        elif op == sre_constants.BRANCH:
+            alternatives = []
+            nullable_count = 0
+            for alternative in av[1]:
+                alternative_atoms, alternative_nullable = _first_atoms(alternative)
+                if alternative_nullable:
+                    nullable_count += 1
+                    alternative_atoms = alternative_atoms + item_follow
+                alternatives.append(alternative_atoms)
+            if nullable_count > 1:
+                return True
+            for i in range(len(alternatives)):
+                for j in range(i + 1, len(alternatives)):
+                    if _overlaps(alternatives[i], alternatives[j]):
+                        return True
+            if any(_is_ambiguous_sequence(alternative, item_follow) for alternative in av[1]):
+                return True
+        elif op in (sre_constants.SUBPATTERN, sre_constants.GROUPREF_EXISTS, sre_constants.MIN_REPEAT, sre_constants.MAX_REPEAT):
+            if any(_is_ambiguous_sequence(sub, item_follow) for sub in _sub_patterns(op, av)):
+                return True
+    return False
+
+
+def _has_ambiguous_repeat(items) -> bool:
+    """
+    Check if any backtracking repeat has a body that can match the same text in more than one way
+    """
+    for op, av in items:
+        if _is_backtracking_repeat(op, av):
+            first, nullable = _first_atoms(av[2])
+            # a bounded repeat of an optional body can spread the same text over its iterations in many ways
+            if nullable and av[1] != sre_constants.MAXREPEAT and len(_all_atoms(av[2])) > 0:
+                return True
+            if _is_ambiguous_sequence(av[2], first):
+                return True
+        if any(_has_ambiguous_repeat(sub) for sub in _sub_patterns(op, av)):
+            return True
+    return False
+
+
+def _contains(items, predicate) -> bool:
+    return any(
+        predicate(op, av) or any(_contains(sub, predicate) for sub in _sub_patterns(op, av))
+        for op, av in items
+    )
+
+
+def _star_height(items) -> int:
+    """
+    Return the maximum nesting depth of backtracking repeats
+    """
+    height = 0
+    for op, av in items:
+        inner = max((_star_height(sub) for sub in _sub_patterns(op, av)), default=0)
+        if _is_backtracking_repeat(op, av):
+            inner += 1
+        height = max(height, inner)
+    return height
+
+
+def _max_sequential_repeats(items) -> int:
+    """
+    Return the maximum number of unbounded repeats in a single sequence
+
+    Groups and alternatives are part of the enclosing sequence and a bounded repeat such as
+    `(.*a){3}` repeats the sequence inside it up to its maximum count
+    """
+    count = 0
+    nested = 0
+    for op, av in items:
+        if _is_unbounded_repeat(op, av):
+            count += 1
+            nested = max(nested, _max_sequential_repeats(av[2]))
+        elif op in _REPEAT_OPS:
+            count += av[1] * _max_sequential_repeats(av[2])
+        elif op in (sre_constants.SUBPATTERN, sre_constants.BRANCH, sre_constants.GROUPREF_EXISTS):
+            count += max((_max_sequential_repeats(sub) for sub in _sub_patterns(op, av)), default=0)
+        else:
+            # possessive repeats, atomic groups and assertions don't backtrack into the enclosing sequence
+            nested = max([nested, *(_max_sequential_repeats(sub) for sub in _sub_patterns(op, av))])
+    return max(count, nested)
+
+
+def _has_repeated_branch(items) -> bool:
+    """
+    Check if an alternation appears under an unbounded repeat
+    """
+    return _contains(
+        items,
+        lambda op, av: _is_unbounded_repeat(op, av)
+        and _contains(av[2], lambda op, av: op == sre_constants.BRANCH),
+    )
+
+
+def _literal_matcher(items) -> tuple[str, Callable[[str], bool]] | None:
+    """
+    Build a string-based matcher for expressions of the form `^?P(.*S)?$?` where P and S are literals
+
+    The matchers follow re.match semantics exactly: `.` doesn't match a newline and `$` also
+    matches before a trailing newline
+    """
+    items = list(items)
+    if len(items) > 0 and items[0][0] == sre_constants.AT and items[0][1] in _BEGIN_ANCHORS:
+        items = items[1:]
+    end_anchor = None
+    if len(items) > 0 and items[-1][0] == sre_constants.AT and items[-1][1] in _END_ANCHORS:
+        end_anchor = items[-1][1]
+        items = items[:-1]
+
+    prefix = []
+    suffix = []
+    has_wildcard = False
+    for op, av in items:
+        if op == sre_constants.LITERAL and av != ord("\n"):
+            (suffix if has_wildcard else prefix).append(chr(av))
+        elif (
+            not has_wildcard
+            and op in _REPEAT_OPS
+            and av[0] == 0
+            and av[1] == sre_constants.MAXREPEAT
+            and list(av[2]) == [(sre_constants.ANY, None)]
+        ):
+            has_wildcard = True
+        else:
+            return None
+    prefix = "".join(prefix)
+    suffix = "".join(suffix)
+    prefix_length = len(prefix)
+    min_length = prefix_length + len(suffix)
+    trailing_newline = end_anchor == sre_constants.AT_END
+
+    if end_anchor is None and suffix == "":
+        return "prefix", lambda path: path.startswith(prefix)
+
+    if end_anchor is None:
+        def match_prefix_contains(path: str) -> bool:
+            if not path.startswith(prefix):
+                return False
+            index = path.find(suffix, prefix_length)
+            return index != -1 and path.find("\n", prefix_length, index) == -1
+
+        return "prefix-contains", match_prefix_contains
+
+    if not has_wildcard:
+        if trailing_newline:
+            prefix_newline = prefix + "\n"
+            return "exact", lambda path: path == prefix or path == prefix_newline
+        return "exact", lambda path: path == prefix
+
+    def match_prefix_suffix(path: str) -> bool:
+        if trailing_newline and path.endswith("\n"):
+            path = path[:-1]
+        return (
+            len(path) >= min_length
+            and path.endswith(suffix)
+            and path.startswith(prefix)
+            and path.find("\n", prefix_length, len(path) - len(suffix)) == -1
+        )
+
+    return "prefix-suffix", match_prefix_suffix
+
+
+def analyze_pattern(expression: str) -> PatternAnalysis:
+    """
+    Classify the matching cost of a path expression and find a cheaper equivalent where possible
+
+    Raises re.error if the expression is not a valid regex
+    """
+    re.compile(expression)
+    if sre_parse is None:
+        return PatternAnalysis(PATTERN_COST_LINEAR, "regex")
+    try:
+        return _analyze_parsed(sre_parse.parse(expression))
+    except re.error:
+        raise
+    except Exception:
+        # the parse tree didn't have the expected shape, never block loading over it
+        return PatternAnalysis(PATTERN_COST_LINEAR, "regex")
+
+
+def _analyze_parsed(parsed) -> PatternAnalysis:
+    # flags such as (?i) or (?m) change the meaning of literals and anchors
+    if parsed.state.flags == re.UNICODE:
+        literal = _literal_matcher(parsed)
+        if literal is not None:
+            kind, matcher = literal
+            return PatternAnalysis(PATTERN_COST_LITERAL, kind, matcher)
+
+    if _has_ambiguous_repeat(parsed):
+        return PatternAnalysis(PATTERN_COST_EXPONENTIAL, "regex")
+    if _max_sequential_repeats(parsed) > 1 or _star_height(parsed) > 1 or _has_repeated_branch(parsed):
+        return PatternAnalysis(PATTERN_COST_POLYNOMIAL, "regex")
+    return PatternAnalysis(PATTERN_COST_LINEAR, "regex")
+
+
 class PathFilter:
+    expression: str
+    regex: re.Pattern
+    analysis: PatternAnalysis
+    match: Callable[[str], bool]  # equivalent to re.match, using the cheapest available check
+
     def __init__(self, expression: str):
         self.expression = expression
-        self._regex = None
-
-    @property
-    def regex(self):
-        if self._regex is None:
-            self._regex = re.compile(self.expression)
-        return self._regex
+        self.regex = re.compile(expression)
+        self.analysis = analyze_pattern(expression)
+        if self.analysis.matcher is not None:
+            self.match = self.analysis.matcher
+        else:
+            regex = self.regex
+            self.match = lambda path: regex.match(path) is not None
 
 
 class SkipIf:
@@ -60,12 +470,22 @@ class Filter:
         self.files = [PathFilter(e) for e in files]
         self.skip_if = skip_if
 
+    @property
+    def path_filters(self) -> list[PathFilter]:
+        """
+        All path filters for the filter (files and skip-if)
+        """
+        skip_filters = []
+        if self.skip_if is not None and self.skip_if.all_file_match_any is not None:
+            skip_filters = self.skip_if.all_file_match_any
+        return [*self.files, *skip_filters]
+
     def is_match_for_file(self, file: str) -> bool:
         """
         Check if the file matches any of the filters
         """
         for path_filter in self.files:
-            if path_filter.regex.match(file):
+            if path_filter.match(file):
                 print(f"Filter {self.name_expression} matched {file} on {path_filter.expression}", flush=True)
                 return True
         return False
@@ -84,7 +504,7 @@ class Filter:
                 allFilesMatchAnySkip
             ):  # only check for skip if we haven't already had a non-match
                 for skip_filter in self.skip_if.all_file_match_any:
-                    is_skip_match = skip_filter.regex.match(file)
+                    is_skip_match = skip_filter.match(file)
                     # print(f"Filter {self.name} skip-if match {file} on {skip_filter.expression}: {is_skip_match}", flush=True)
                     if not is_skip_match:
                         print(
@@ -109,7 +529,7 @@ class Filter:
 
         for file in files:
             for path_filter in self.files:
-                if path_filter.regex.match(file):
+                if path_filter.match(file):
                     # print(f"Adding {file} to hash", flush=True)
                     # Add the filename to the hash
                     hash.update(file.encode("utf-8"))
@@ -122,19 +542,235 @@ class Filter:
 
         return hash.hexdigest()
 
-def load_git_changes(compare_to: str = "main") -> list[str]:
+
+# bump when the matching code (e.g. PathFilter.match or the literal rewrites) or the index layout
+# changes so that persisted indexes are rebuilt
+PATH_INDEX_VERSION = 2
+
+
+def filter_set_digest(filters: list[Filter]) -> str:
+    """
+    Calculate a digest of the filter set definition (name, files and skip-if expressions, in order)
+    and the path index version
+    """
+    definition: list = [PATH_INDEX_VERSION]
+    for filter in filters:
+        skip_expressions = None
+        if filter.skip_if is not None and filter.skip_if.all_file_match_any is not None:
+            skip_expressions = [path_filter.expression for path_filter in filter.skip_if.all_file_match_any]
+        definition.append(
+            [filter.name_expression, [path_filter.expression for path_filter in filter.files], skip_expressions]
+        )
+    return hashlib.sha1(json.dumps(definition).encode("utf-8")).hexdigest()
+
+
+class PathIndex:
+    """
+    Persistent index mapping each known path to the filters it matches
+
+    Each path maps to a pair of bitmasks over the filter positions: the filters with a files
+    expression that matches the path and the filters with a skip-if expression that matches it.
+    Paths already in the index are classified with a single lookup, the regexes only run for
+    new paths. The index is keyed by the filter set digest and is rebuilt from scratch when the
+    filter definitions change.
+    """
+
+    def __init__(self, filters: list[Filter], index_file: str):
+        self.filters = filters
+        self.index_file = index_file
+        self.digest = filter_set_digest(filters)
+        self.paths: dict[str, list[int]] = {}
+        self.new_path_count = 0
+        self._positions = {id(filter): position for position, filter in enumerate(filters)}
+        self._dirty = False
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            print(f"Path index {self.index_file} not found, building a new index", flush=True)
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                index_data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Path index {self.index_file} could not be loaded ({e}), building a new index", flush=True)
+            return
+        if not isinstance(index_data, dict) or not isinstance(index_data.get("paths"), dict):
+            print(f"Path index {self.index_file} is not in the expected format, building a new index", flush=True)
+            self._dirty = True
+            return
+        if index_data.get("digest") != self.digest:
+            print(f"Path index {self.index_file} is for a different filter set, rebuilding", flush=True)
+            self._dirty = True
+            return
+        self.paths = index_data["paths"]
+        print(f"Loaded path index {self.index_file} with {len(self.paths)} paths", flush=True)
+
+    def save(self):
+        if not self._dirty:
+            return
+        # write to a temporary file and rename so an interrupted run doesn't leave a corrupt index
+        temp_file = f"{self.index_file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"digest": self.digest, "paths": self.paths}, f, separators=(",", ":"))
+        os.replace(temp_file, self.index_file)
+        self._dirty = False
+        print(f"Saved path index {self.index_file} with {len(self.paths)} paths", flush=True)
+
+    def classify(self, path: str) -> list[int]:
+        """
+        Return the [files, skip-if] bitmasks for the path, evaluating the filters if it isn't indexed
+        """
+        masks = self.paths.get(path)
+        if masks is not None:
+            return masks
+
+        files_mask = 0
+        skip_mask = 0
+        for position, filter in enumerate(self.filters):
+            if any(path_filter.match(path) for path_filter in filter.files):
+                files_mask |= 1 << position
+            # same as Filter.is_match, a path only counts towards skipping if every skip-if expression matches it
+            if filter.skip_if is not None and filter.skip_if.all_file_match_any is not None:
+                if all(path_filter.match(path) for path_filter in filter.skip_if.all_file_match_any):
+                    skip_mask |= 1 << position
+        masks = [files_mask, skip_mask]
+        self.paths[path] = masks
+        self.new_path_count += 1
+        self._dirty = True
+        return masks
+
+    def is_match(self, filter: Filter, files: Iterable[str]) -> bool:
+        """
+        Equivalent to filter.is_match(files) using the indexed classification
+        """
+        bit = 1 << self._positions[id(filter)]
+        match = False
+        allFilesMatchAnySkip = (
+            filter.skip_if is not None and filter.skip_if.all_file_match_any is not None
+        )
+        for file in files:
+            files_mask, skip_mask = self.classify(file)
+            if not match and files_mask & bit:
+                # re-run the expressions for this one file to log which one matched
+                filter.is_match_for_file(file)
+                match = True
+            if allFilesMatchAnySkip and not skip_mask & bit:
+                print(f"Filter {filter.name_expression} skip-if failed to match {file}", flush=True)
+                allFilesMatchAnySkip = False
+            if match and not allFilesMatchAnySkip:
+                break
+        print(f"Filter {filter.name_expression} match: {match}, allFilesMatchAnySkip: {allFilesMatchAnySkip}", flush=True)
+        return match and not allFilesMatchAnySkip
+
+
+def run_git(args: list[str], repo_path: str = ".") -> str:
+    result = subprocess.run(
+        ["git", *args],
+        cwd=repo_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout
+
+
+def is_shallow_repository(repo_path: str = ".") -> bool:
+    return run_git(["rev-parse", "--is-shallow-repository"], repo_path).strip() == "true"
+
+
+def ref_exists(ref: str, repo_path: str = ".") -> bool:
+    try:
+        run_git(["rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"], repo_path)
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+
+def try_merge_base(compare_to: str, repo_path: str = ".", head: str = "HEAD") -> str | None:
+    try:
+        return run_git(["merge-base", head, compare_to], repo_path).strip()
+    except subprocess.CalledProcessError:
+        # exit code 1 means no common ancestor (yet), other codes mean compare_to is unknown
+        return None
+
+
+def find_merge_base(
+    compare_to: str,
+    remote: str = "origin",
+    repo_path: str = ".",
+    initial_depth: int = 8,
+    max_depth: int = 4096,
+    head: str = "HEAD",
+) -> str:
+    """
+    Find the merge base between head and compare_to, deepening a shallow clone as needed
+
+    In a shallow clone (e.g. actions/checkout with fetch-depth: 1) the base branch may not
+    have been fetched and the common ancestor is usually beyond the shallow boundary.
+    When compare_to is a remote-tracking ref (e.g. origin/main), fetch it and then deepen
+    the history in doubling steps until the merge base is reachable. Once the total depth
+    exceeds max_depth, fall back to fetching the full history.
+
+    Raises subprocess.CalledProcessError if a git command fails and ValueError if no merge
+    base can be found
+    """
+    merge_base = try_merge_base(compare_to, repo_path, head)
+    if merge_base is not None:
+        return merge_base
+    if not is_shallow_repository(repo_path):
+        raise ValueError(f"No merge base found between {head} and {compare_to}")
+    if not compare_to.startswith(f"{remote}/"):
+        raise ValueError(f"Cannot deepen shallow clone to find {compare_to} (not a {remote}/ ref)")
+
+    branch = compare_to[len(remote) + 1:]
+    refspec = f"+refs/heads/{branch}:refs/remotes/{remote}/{branch}"
+
+    if not ref_exists(compare_to, repo_path):
+        print(f"Fetching {compare_to} with depth {initial_depth}...", flush=True)
+        run_git(["fetch", "--no-tags", f"--depth={initial_depth}", remote, refspec], repo_path)
+        depth = initial_depth
+    else:
+        depth = 0
+
+    step = initial_depth
+    while True:
+        merge_base = try_merge_base(compare_to, repo_path, head)
+        if merge_base is not None:
+            print(f"Found merge base {merge_base} after deepening by {depth} commits", flush=True)
+            return merge_base
+        if not is_shallow_repository(repo_path):
+            raise ValueError(f"No merge base found between {head} and {compare_to}")
+
+        if depth >= max_depth:
+            print(f"Merge base not found within {depth} commits, fetching full history...", flush=True)
+            run_git(["fetch", "--no-tags", "--unshallow", remote, refspec], repo_path)
+            continue
+
+        # --deepen moves the shallow boundary of every fetched history (including HEAD)
+        print(f"Deepening history by {step} commits...", flush=True)
+        run_git(["fetch", "--no-tags", f"--deepen={step}", remote, refspec], repo_path)
+        depth += step
+        step *= 2
+
+
+def load_git_changes(
+    compare_to: str = "main", remote: str = "origin", repo_path: str = ".", head: str | None = None
+) -> list[str]:
+    """
+    Load the files changed relative to the merge base with compare_to
+
+    By default the working tree is compared, pass head to compare a commit instead (e.g. a branch)
+    """
     print("Attempting to load changes via git...", flush=True)
-    # TODO - update to find common ancestor from current commit to compare_to
     # TODO - explore using GH API to get changed files - would remove the need to checkout code
     #        https://docs.github.com/en/rest/pulls/pulls?apiVersion=2022-11-28#list-pull-requests-files
     try:
-        result = subprocess.run(
-            ["git", "diff", "--name-only", compare_to],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        files = result.stdout.splitlines()
+        merge_base = find_merge_base(compare_to, remote=remote, repo_path=repo_path, head=head or "HEAD")
+        print(f"Comparing against merge base {merge_base} of {compare_to}", flush=True)
+        diff_args = ["diff", "--name-only", merge_base]
+        if head is not None:
+            diff_args.append(head)
+        files = run_git(diff_args, repo_path).splitlines()
         print(f"Got {len(files)} changed files from git", flush=True)
         return files
     except subprocess.CalledProcessError as e:
@@ -142,6 +778,9 @@ def load_git_changes(compare_to: str = "main") -> list[str]:
             f"Error getting git changes: {e}\n{e.stdout}\n{e.stderr}", file=sys.stderr, flush=True
         )
         sys.exit(1)
+    except ValueError as e:
+        print(f"Error getting git changes: {e}", file=sys.stderr, flush=True)
+        sys.exit(1)
 
 
 def load_pr_changes() -> list[str]:
@@ -231,20 +870,67 @@ def load_filter_file(filter_file: str) -> list[Filter]:
             print(f"Filter file {filter_file} files list is empty.", flush=True)
             sys.exit(1)
 
-        skip_if = None
-        if "skip-if" in filter_item:
-            if "all-files-match-any" in filter_item["skip-if"]:
-                skip_if = SkipIf(filter_item["skip-if"]["all-files-match-any"])
+        try:
+            skip_if = None
+            if "skip-if" in filter_item:
+                if "all-files-match-any" in filter_item["skip-if"]:
+                    skip_if = SkipIf(filter_item["skip-if"]["all-files-match-any"])
 
-        filter = Filter(
-            name_regex=filter_item["name"],
-            files=filter_item["files"],
-            skip_if=skip_if,
-        )
+            filter = Filter(
+                name_regex=filter_item["name"],
+                files=filter_item["files"],
+                skip_if=skip_if,
+            )
+        except re.error as e:
+            print(f"Filter file {filter_file} filter {filter_item['name']} has an invalid expression: {e}", flush=True)
+            sys.exit(1)
+        for path_filter in filter.path_filters:
+            analysis = path_filter.analysis
+            if analysis.cost == PATTERN_COST_EXPONENTIAL:
+                print(
+                    f"Filter {filter.name_expression} expression {path_filter.expression} has nested repeats "
+                    "and can backtrack catastrophically.",
+                    flush=True,
+                )
+                sys.exit(1)
+            if analysis.cost == PATTERN_COST_POLYNOMIAL:
+                print(
+                    f"WARNING: Filter {filter.name_expression} expression {path_filter.expression} has several "
+                    "unbounded repeats in sequence, match time grows polynomially with path length.",
+                    flush=True,
+                )
         filters.append(filter)
 
     return filters
 
+
+def profile_path_filters(filters: list[Filter], files: list[str]) -> list[tuple[PathFilter, int, float, float]]:
+    """
+    Time each unique path expression against the file list
+
+    Returns (path filter, match count, match time, regex time) tuples, slowest first.
+    Regex time is the time for plain re.match to compare against any rewrite.
+    """
+    path_filters = {}
+    for filter in filters:
+        for path_filter in filter.path_filters:
+            path_filters.setdefault(path_filter.expression, path_filter)
+
+    results = []
+    for path_filter in path_filters.values():
+        start_time = time.perf_counter()
+        match_count = sum(1 for file in files if path_filter.match(file))
+        match_time = time.perf_counter() - start_time
+
+        regex = path_filter.regex
+        start_time = time.perf_counter()
+        for file in files:
+            regex.match(file)
+        regex_time = time.perf_counter() - start_time
+
+        results.append((path_filter, match_count, match_time, regex_time))
+    return sorted(results, key=lambda r: r[2], reverse=True)
+
 def recursive_file_list(path: str) -> Iterable[str]:
     for root, dirnames, files in os.walk(path, topdown=True):
         if ".git" in dirnames:
@@ -300,6 +986,25 @@ if __name__ == "__main__":
     filters = load_filter_file(filter_file)
     print(f"Loaded filter file {filter_file} with filters {[f.name_expression for f in filters]}", flush=True)
 
+    if os.getenv("PROFILE_PATTERNS", "false").lower() == "true":
+        repo_files = list(recursive_file_list("."))
+        append_to_step_summary(f"## Pattern profile ({len(repo_files)} files)")
+        append_to_step_summary("|Expression|Cost|Kind|Matches|Time (ms)|Regex time (ms)|")
+        append_to_step_summary("|---|---|---|---|---|---|")
+        for path_filter, match_count, match_time, regex_time in profile_path_filters(filters, repo_files):
+            analysis = path_filter.analysis
+            print(
+                f"Pattern {path_filter.expression} ({analysis.cost}, {analysis.kind}): {match_count} matches "
+                f"in {match_time * 1000:.3f}ms (regex {regex_time * 1000:.3f}ms)",
+                flush=True,
+            )
+            # escape `|` so alternations don't split the table cell
+            escaped_expression = path_filter.expression.replace("|", "\\|")
+            append_to_step_summary(
+                f"|`{escaped_expression}`|{analysis.cost}|{analysis.kind}|{match_count}"
+                f"|{match_time * 1000:.3f}|{regex_time * 1000:.3f}|"
+            )
+
     file_change_list = load_pr_changes()
     got_changes_from_git = False
     if file_change_list is None:
@@ -315,6 +1020,12 @@ if __name__ == "__main__":
         append_to_step_summary(f"Changed files: {file_change_list}")
         print(f"Changed files: {file_change_list}", flush=True)
 
+    path_index = None
+    path_index_file = os.getenv("PATH_INDEX_FILE", ".path-index.json")
+    if path_index_file != "":
+        path_index = PathIndex(filters, path_index_file)
+        path_index.load()
+
     append_to_step_summary("|Job|Filter|Result|")
     append_to_step_summary("|---|---|---|")
     jobs = get_job_list(workflow_file)
@@ -330,10 +1041,17 @@ if __name__ == "__main__":
             print(f"Job {job} did not match any filters", flush=True)
             append_to_step_summary(f"|{job}|<none>| |")
             continue
-        filter_matches = filter.is_match(file_change_list)
+        if path_index is not None:
+            filter_matches = path_index.is_match(job_filter, file_change_list)
+        else:
+            filter_matches = job_filter.is_match(file_change_list)
         result[job] = filter_matches
         append_to_step_summary(f"|{job}|{job_filter.name_expression}|{str(filter_matches).lower()}")
 
+    if path_index is not None:
+        print(f"Path index: classified {path_index.new_path_count} new paths", flush=True)
+        path_index.save()
+
 
     append_to_step_summary(f"\n\n<details><summary>Filter output</summary>\n\n```json\n{json.dumps(result, indent=2)}\n```\n\n</details>\n\n")
     set_github_output("filter_result", json.dumps(result))
@@ -0,0 +1,109 @@
+import subprocess
+
+import pytest
+
+from .generate_change_sets import ChangeSetShape, generate_change_sets
+from .process_path_filter import load_git_changes
+
+
+def git(repo_path, *args):
+	return subprocess.run(
+		["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+		cwd=repo_path,
+		check=True,
+		capture_output=True,
+		text=True,
+	).stdout.strip()
+
+
+def create_repo(tmp_path):
+	repo = tmp_path / "repo"
+	for directory in ["src/a", "src/b", "src/c", "docs"]:
+		(repo / directory).mkdir(parents=True)
+		for i in range(10):
+			(repo / directory / f"file{i}.txt").write_text(f"{directory} {i}\n")
+	git(repo, "init", "-q", "-b", "main")
+	git(repo, "add", ".")
+	git(repo, "commit", "-q", "-m", "initial")
+	return repo
+
+
+def test_generate_change_sets_shapes(tmp_path):
+	repo = create_repo(tmp_path)
+	shape = ChangeSetShape(
+		name="mixed",
+		branches=5,
+		files=10,
+		directories=2,
+		path_prefix="src/",
+		skip_fraction=0.2,
+		rename_fraction=0.2,
+		delete_fraction=0.1,
+	)
+
+	change_sets = generate_change_sets([shape], "main", seed=1, repo_path=repo)
+	assert [c.branch for c in change_sets] == [f"synthetic/mixed-{i:05d}" for i in range(5)]
+
+	for change_set in change_sets:
+		status = git(repo, "diff", "--name-status", "-M", "main", change_set.branch).splitlines()
+		kinds = sorted(line[0] for line in status)
+		assert kinds == ["A", "A", "D", "M", "M", "M", "M", "M", "R", "R"]
+		assert sum(1 for line in status if line.endswith(".md")) == 2
+		assert len({line.split("\t")[-1].rsplit("/", 1)[0] for line in status}) == 2
+		assert all(line.split("\t")[-1].startswith("src/") for line in status)
+
+		files = load_git_changes("main", repo_path=repo, head=change_set.branch)
+		assert sorted(files) == change_set.changed_files
+
+
+def test_generate_change_sets_rounded_fractions(tmp_path):
+	repo = create_repo(tmp_path)
+	# 3 * 0.5 rounds to 2 for both renames and deletes, the total must still be 3 files
+	shape = ChangeSetShape(name="rounded", branches=3, files=3, directories=1, rename_fraction=0.5, delete_fraction=0.5)
+
+	for change_set in generate_change_sets([shape], "main", seed=3, repo_path=repo):
+		assert len(change_set.changed_files) == 3
+		assert len(change_set.deleted) == 2
+		assert len(change_set.renamed) == 1
+		assert len(git(repo, "diff", "--name-only", "-M", "main", change_set.branch).splitlines()) == 3
+
+
+def test_generate_change_sets_is_repeatable(tmp_path):
+	repo = create_repo(tmp_path)
+	shape = ChangeSetShape(name="small", branches=3, files=4, directories=1)
+
+	first = generate_change_sets([shape], "main", seed=7, repo_path=repo)
+	trees = [git(repo, "rev-parse", f"{c.branch}^{{tree}}") for c in first]
+
+	# regenerating with the same seed overwrites the branches with the same content
+	second = generate_change_sets([shape], "main", seed=7, repo_path=repo)
+	assert [c.changed_files for c in second] == [c.changed_files for c in first]
+	assert [git(repo, "rev-parse", f"{c.branch}^{{tree}}") for c in second] == trees
+
+
+@pytest.mark.parametrize(
+	"overrides",
+	[
+		{"directories": 0},
+		{"files": 0},
+		{"branches": 0},
+		{"files": 2.5},
+		{"branches": "3"},
+		{"rename_fraction": -0.1},
+		{"skip_fraction": 1.5},
+	],
+)
+def test_change_set_shape_validation(overrides):
+	arguments = {"name": "invalid", "branches": 1, "files": 1, "directories": 1, **overrides}
+	with pytest.raises(ValueError):
+		ChangeSetShape(**arguments)
+
+
+def test_generate_change_sets_warns_when_directories_run_out(tmp_path, capsys):
+	repo = create_repo(tmp_path)
+	# each directory has 10 files, 15 deletes in one directory can't all be existing files
+	shape = ChangeSetShape(name="exhausted", branches=2, files=15, directories=1, path_prefix="docs", delete_fraction=1.0)
+
+	change_sets = generate_change_sets([shape], "main", seed=5, repo_path=repo)
+	assert all(len(c.deleted) == 10 and c.substituted == 5 for c in change_sets)
+	assert "WARNING: Shape exhausted" in capsys.readouterr().out
@@ -1,4 +1,25 @@
-from .process_path_filter import Filter, SkipIf
+import re
+import subprocess
+
+import pytest
+
+from . import process_path_filter
+from .process_path_filter import (
+	PATTERN_COST_EXPONENTIAL,
+	PATTERN_COST_LINEAR,
+	PATTERN_COST_LITERAL,
+	PATTERN_COST_POLYNOMIAL,
+	Filter,
+	PathFilter,
+	PathIndex,
+	SkipIf,
+	analyze_pattern,
+	find_merge_base,
+	is_shallow_repository,
+	load_filter_file,
+	load_git_changes,
+	profile_path_filters,
+)
 
 
 def test_simple_match():
@@ -24,4 +45,281 @@ def test_skip_files():
 	assert not filter.is_match(["test.py"])
 	assert not filter.is_match(["abc"])
 	assert filter.is_match(["test.txt", "test.py"])
-	assert filter.is_match(["abc", "test.py"])
\ No newline at end of file
+	assert filter.is_match(["abc", "test.py"])
+
+
+@pytest.mark.parametrize(
+	"expression,cost,kind",
+	[
+		("test", PATTERN_COST_LITERAL, "prefix"),
+		("^abc/", PATTERN_COST_LITERAL, "prefix"),
+		("^dummy_files/.*", PATTERN_COST_LITERAL, "prefix"),
+		("^abc/def$", PATTERN_COST_LITERAL, "exact"),
+		("\\.md$", PATTERN_COST_LITERAL, "exact"),
+		("^.*\\.py$", PATTERN_COST_LITERAL, "prefix-suffix"),
+		("^uplane/.*list_dependencies\\.sh$", PATTERN_COST_LITERAL, "prefix-suffix"),
+		("^src/.*test", PATTERN_COST_LITERAL, "prefix-contains"),
+		("(?i)^abc/", PATTERN_COST_LINEAR, "regex"),
+		("^(abc|def)/", PATTERN_COST_LINEAR, "regex"),
+		("^src/[a-z]+\\.txt$", PATTERN_COST_LINEAR, "regex"),
+		("^src/.*/test/.*\\.py$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(a+)+$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(.*/)*x$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(a++)+$", PATTERN_COST_LINEAR, "regex"),
+		("^(a|b)+$", PATTERN_COST_LINEAR, "regex"),
+		("^x{2,5}y$", PATTERN_COST_LINEAR, "regex"),
+		("^(.*)a(.*)b$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(.*a){3}$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(ab|cd)+$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(.*a){12}$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(a|a)+$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(a|ab)+$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(a|aa)+$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(x|[a-z]+)+$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(?(1)a|(a+)+)$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^(a?){24}a{24}$", PATTERN_COST_EXPONENTIAL, "regex"),
+		("^([^/]+/)*foo\\.py$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(\\w+/)*x$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^(?:[^/]*/)*[^/]*\\.md$", PATTERN_COST_POLYNOMIAL, "regex"),
+		("^src/.*/tests/.*/fixtures/.*/.*/.*\\.json$", PATTERN_COST_POLYNOMIAL, "regex"),
+	],
+)
+def test_analyze_pattern(expression, cost, kind):
+	analysis = analyze_pattern(expression)
+	assert analysis.cost == cost
+	assert analysis.kind == kind
+	assert (analysis.matcher is not None) == (kind != "regex")
+
+
+def test_analyze_pattern_fails_open(monkeypatch):
+	def unexpected_parse_tree(items):
+		raise TypeError("unexpected parse tree")
+
+	monkeypatch.setattr(process_path_filter, "_has_ambiguous_repeat", unexpected_parse_tree)
+	assert analyze_pattern("^(a+)+$").cost == PATTERN_COST_LINEAR
+
+	monkeypatch.setattr(process_path_filter, "sre_parse", None)
+	assert analyze_pattern("^abc/").cost == PATTERN_COST_LINEAR
+	assert PathFilter("^abc/").match("abc/def")
+	with pytest.raises(re.error):
+		analyze_pattern("^(abc")
+
+
+@pytest.mark.parametrize(
+	"expression",
+	[
+		"test", "^abc/", "^abc/def$", "^abc/def\\Z", "\\.md$", "^.*\\.py$", "^.*\\.py\\Z", "^uplane/.*list_dependencies\\.sh$",
+		"^src/.*test", "^a.*$", "^.*$",
+	],
+)
+def test_rewritten_pattern_matches_regex(expression):
+	paths = [
+		"", "test", "test.py", "abc", "abc/", "abc/def", "abc/def\n", "abc/defg", ".md", ".md\n", "x.md", "a.py",
+		".py", "py", "a\nb.py", "uplane/list_dependencies.sh", "uplane/x/list_dependencies.sh",
+		"uplane/list_dependencies.sh.bak", "uplane/\nlist_dependencies.sh", "src/test", "src/a/test.py", "src/tes", "src/\ntest", "src/test\n", "a.py\n", "a\n", "\n",
+	]
+	path_filter = PathFilter(expression)
+	regex = re.compile(expression)
+	for path in paths:
+		assert path_filter.match(path) == (regex.match(path) is not None), path
+
+
+def write_filter_file(tmp_path, expression):
+	filter_file = tmp_path / "filter.yaml"
+	filter_file.write_text(f"- name: test\n  files:\n    - '^src/'\n  skip-if:\n    all-files-match-any:\n      - '{expression}'\n")
+	return str(filter_file)
+
+
+def test_load_filter_file_rejects_exponential_pattern(tmp_path):
+	with pytest.raises(SystemExit):
+		load_filter_file(write_filter_file(tmp_path, "^(a+)+$"))
+
+
+def test_load_filter_file_rejects_invalid_pattern(tmp_path):
+	with pytest.raises(SystemExit):
+		load_filter_file(write_filter_file(tmp_path, "^(abc"))
+
+
+@pytest.mark.parametrize("expression", ["^.*/.*\\.md$", "^([^/]+/)*foo\\.py$", "^src/.*/tests/.*/fixtures/.*/.*/.*\\.json$"])
+def test_load_filter_file_warns_polynomial_pattern(tmp_path, capsys, expression):
+	filters = load_filter_file(write_filter_file(tmp_path, expression))
+	assert len(filters) == 1
+	assert "WARNING" in capsys.readouterr().out
+
+
+def test_profile_path_filters():
+	filters = [
+		Filter(name_regex="a", files=["^src/", "^docs/"], skip_if=SkipIf(all_file_match_any=["^.*\\.md$"])),
+		Filter(name_regex="b", files=["^src/"]),
+	]
+	files = ["src/a.py", "src/b.md", "docs/c.md", "other.txt"]
+	results = profile_path_filters(filters, files)
+	counts = {path_filter.expression: match_count for path_filter, match_count, _, _ in results}
+	assert counts == {"^src/": 2, "^docs/": 1, "^.*\\.md$": 2}
+
+
+def create_index_filters(skip_expression="\\.md$"):
+	return [
+		Filter(name_regex="src", files=["^src/"], skip_if=SkipIf(all_file_match_any=[f"^.*{skip_expression}"])),
+		Filter(name_regex="docs", files=["^docs/", "^README"]),
+	]
+
+
+def test_path_index_matches_filter(tmp_path):
+	# a path only counts towards skipping if every skip-if expression matches it
+	filters = create_index_filters() + [
+		Filter(name_regex="multi", files=["^src/"], skip_if=SkipIf(all_file_match_any=["^.*\\.md$", "^.*\\.txt$"])),
+		Filter(name_regex="generated", files=["^src/"], skip_if=SkipIf(all_file_match_any=["^src/gen/", "^.*\\.md$"])),
+	]
+	index = PathIndex(filters, str(tmp_path / "index.json"))
+	change_lists = [
+		[],
+		["src/a.py"],
+		["src/a.md"],
+		["src/a.md", "docs/b.md"],
+		["src/a.md", "other.txt"],
+		["src/a.txt"],
+		["src/gen/a.md"],
+		["src/gen/a.md", "src/gen/b.py"],
+		["README.md", "docs/x"],
+		["other.txt"],
+	]
+	for files in change_lists:
+		for filter in filters:
+			assert index.is_match(filter, files) == filter.is_match(files), (filter.name_expression, files)
+
+
+def test_path_index_logs_matching_file(tmp_path, capsys):
+	filters = create_index_filters()
+	index = PathIndex(filters, str(tmp_path / "index.json"))
+	assert index.is_match(filters[1], ["src/a.py", "README.md", "docs/b.md"])
+	output = capsys.readouterr().out
+	assert "Filter docs matched README.md on ^README" in output
+	assert "docs/b.md" not in output
+
+
+def test_path_index_incremental_update(tmp_path):
+	index_file = str(tmp_path / "index.json")
+	index = PathIndex(create_index_filters(), index_file)
+	index.load()
+	assert index.is_match(index.filters[0], ["docs/b.md", "src/a.py"])
+	assert index.new_path_count == 2
+	index.save()
+
+	index = PathIndex(create_index_filters(), index_file)
+	index.load()
+	assert index.paths == {"src/a.py": [1, 0], "docs/b.md": [2, 1]}
+	assert index.is_match(index.filters[1], ["docs/c.txt", "src/a.py", "docs/b.md"])
+	assert index.new_path_count == 1
+	index.save()
+
+	index = PathIndex(create_index_filters(), index_file)
+	index.load()
+	assert sorted(index.paths) == ["docs/b.md", "docs/c.txt", "src/a.py"]
+
+
+def test_path_index_rebuilds_when_filters_change(tmp_path):
+	index_file = str(tmp_path / "index.json")
+	index = PathIndex(create_index_filters(), index_file)
+	index.classify("src/a.md")
+	index.save()
+
+	index = PathIndex(create_index_filters(skip_expression="\\.txt$"), index_file)
+	index.load()
+	assert index.paths == {}
+	assert index.classify("src/a.md") == [1, 0]
+	index.save()
+
+	index = PathIndex(create_index_filters(skip_expression="\\.txt$"), index_file)
+	index.load()
+	assert index.paths == {"src/a.md": [1, 0]}
+
+
+def test_path_index_rebuilds_when_version_changes(tmp_path, monkeypatch):
+	index_file = str(tmp_path / "index.json")
+	index = PathIndex(create_index_filters(), index_file)
+	index.classify("src/a.md")
+	index.save()
+
+	monkeypatch.setattr(process_path_filter, "PATH_INDEX_VERSION", process_path_filter.PATH_INDEX_VERSION + 1)
+	index = PathIndex(create_index_filters(), index_file)
+	index.load()
+	assert index.paths == {}
+
+
+@pytest.mark.parametrize("content", ["[]", "{\"digest\": \"{digest}\"}", "{\"digest\": \"{digest}\", \"paths\": []}", "not json"])
+def test_path_index_rebuilds_invalid_index(tmp_path, content):
+	index_file = tmp_path / "index.json"
+	index = PathIndex(create_index_filters(), str(index_file))
+	index_file.write_text(content.replace("{digest}", index.digest))
+	index.load()
+	assert index.paths == {}
+	assert index.classify("src/a.md") == [1, 1]
+	index.save()
+
+	index = PathIndex(create_index_filters(), str(index_file))
+	index.load()
+	assert index.paths == {"src/a.md": [1, 1]}
+
+
+def git(repo_path, *args):
+	return subprocess.run(
+		["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+		cwd=repo_path,
+		check=True,
+		capture_output=True,
+		text=True,
+	).stdout.strip()
+
+
+def commit_file(repo_path, name, content):
+	(repo_path / name).write_text(content)
+	git(repo_path, "add", name)
+	git(repo_path, "commit", "-q", "-m", f"update {name}")
+
+
+def create_shallow_clone(tmp_path, main_commits, feature_commits):
+	# build main + feature history, publish to a bare remote and shallow clone the feature branch
+	source = tmp_path / "source"
+	source.mkdir()
+	git(source, "init", "-q", "-b", "main")
+	for i in range(main_commits):
+		commit_file(source, "main.txt", f"{i}")
+	fork_point = git(source, "rev-parse", "HEAD")
+	git(source, "checkout", "-q", "-b", "feature")
+	for i in range(feature_commits):
+		commit_file(source, f"feature{i}.txt", f"{i}")
+	git(source, "checkout", "-q", "main")
+	for i in range(main_commits):
+		commit_file(source, "after.txt", f"{i}")
+
+	remote = tmp_path / "remote.git"
+	git(tmp_path, "clone", "-q", "--bare", str(source), str(remote))
+	work = tmp_path / "work"
+	git(tmp_path, "clone", "-q", "--depth=1", "--branch", "feature", remote.as_uri(), str(work))
+	return work, fork_point
+
+
+def test_find_merge_base_deepens_shallow_clone(tmp_path):
+	work, fork_point = create_shallow_clone(tmp_path, main_commits=60, feature_commits=30)
+	assert is_shallow_repository(work)
+
+	merge_base = find_merge_base("origin/main", repo_path=work, initial_depth=4)
+	assert merge_base == fork_point
+	# history should only be deepened as far as needed
+	assert is_shallow_repository(work)
+
+
+def test_find_merge_base_unshallows_after_max_depth(tmp_path):
+	work, fork_point = create_shallow_clone(tmp_path, main_commits=20, feature_commits=30)
+
+	merge_base = find_merge_base("origin/main", repo_path=work, initial_depth=2, max_depth=4)
+	assert merge_base == fork_point
+	assert not is_shallow_repository(work)
+
+
+def test_load_git_changes_shallow_clone(tmp_path):
+	work, _ = create_shallow_clone(tmp_path, main_commits=5, feature_commits=3)
+
+	files = load_git_changes("origin/main", repo_path=work)
+	assert sorted(files) == ["feature0.txt", "feature1.txt", "feature2.txt"]